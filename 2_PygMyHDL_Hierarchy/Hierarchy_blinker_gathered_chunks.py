@@ -1,4 +1,9 @@
 
+import filecmp
+import os
+import shutil
+import tempfile
+
 from pygmyhdl import *
 
 @chunk
@@ -185,4 +190,34 @@ clk_sim(clk, num_cycles=16)  # Apply 16 clock pulses.
 show_waveforms()             # Look at the waveforms.
 
 
-toVerilog(blinker, clk_i=clk, led_o=led, length=22)
+def convert_to(settings, chunk, *args, **kwargs):
+    '''
+    Convert a chunk to Verilog with some toVerilog settings (name, directory, no_testbench, ...)
+    changed for just this conversion. The old settings are put back even if the conversion fails.
+    '''
+    old_settings = {setting: getattr(toVerilog, setting) for setting in settings}
+    try:
+        for setting, value in settings.items():
+            setattr(toVerilog, setting, value)
+        return toVerilog(chunk, *args, **kwargs)
+    finally:
+        for setting, value in old_settings.items():
+            setattr(toVerilog, setting, value)
+
+def to_verilog_if_changed(chunk, *args, **kwargs):
+    '''
+    Convert a chunk to Verilog, but only overwrite the existing files if their contents changed.
+    The MyHDL date header is left out so converting an unchanged design gives identical files
+    and the synthesis tools don't see a newer file that forces them to run again.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Write the Verilog files into a scratch directory without the time-stamped header.
+        convert_to(dict(directory=tmp_dir, no_myhdl_header=True), chunk, *args, **kwargs)
+        for file_name in sorted(os.listdir(tmp_dir)):
+            new_file = os.path.join(tmp_dir, file_name)
+            dest = os.path.join(toVerilog.directory or '', file_name)  # Where toVerilog would have put it.
+            if os.path.exists(dest) and filecmp.cmp(new_file, dest, shallow=False):
+                continue  # Same contents, so leave the old file (and its timestamp) alone.
+            shutil.copy(new_file, dest)
+
+to_verilog_if_changed(blinker, clk_i=clk, led_o=led, length=22)
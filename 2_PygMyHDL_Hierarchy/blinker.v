@@ -1,7 +1,3 @@
-// File: blinker.v
-// Generated by MyHDL 0.11
-// Date: Sun Nov  1 15:51:12 2020
-
 
 `timescale 1ns/10ps
 
@@ -1,10 +1,74 @@
-# A function I'll use later to extract FPGA resource usage stats from Yosys log output.
+# Functions I'll use later to extract FPGA resource usage stats from Yosys log output.
+import itertools
+import os
+import re
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# FPGA resources used by a design, plus the lines of the Yosys statistics section they came from.
+YosysStats = namedtuple('YosysStats', 'luts dffs rams carries cells lines')
+
+def parse_stats(log_lines):
+    '''
+    Scan the Yosys log output one line at a time and return the resource usage found in
+    the last "Printing statistics" section. The log can be any iterable of lines (the output
+    of a ! shell command, an open log file, or the pipe from run_yosys()) so only the
+    statistics section is ever kept in memory, no matter how big the log is.
+    '''
+    stats, section = None, None
+    for line in log_lines:
+        line = line.rstrip('\n')
+        if re.match(r'^\d+(\.\d+)*\. ', line):
+            # A numbered heading starts a new Yosys pass. Finish up any statistics that
+            # were being collected and start collecting if this is a statistics pass.
+            if section is not None:
+                stats = section
+            section = dict(luts=0, dffs=0, rams=0, carries=0, cells=0, lines=[]) if 'Printing statistics' in line else None
+            continue
+        if section is None:
+            continue
+        section['lines'].append(line)
+        cells = re.match(r'^\s+Number of cells:\s+(\d+)', line)
+        if cells:
+            section['cells'] = int(cells.group(1))
+            continue
+        cell = re.match(r'^\s+(SB_\w+)\s+(\d+)\s*$', line)
+        if cell:
+            cell_type, count = cell.group(1), int(cell.group(2))
+            if cell_type.startswith('SB_LUT'):
+                section['luts'] += count
+            elif cell_type.startswith('SB_DFF'):
+                section['dffs'] += count
+            elif cell_type.startswith('SB_RAM'):
+                section['rams'] += count
+            elif cell_type.startswith('SB_CARRY'):
+                section['carries'] += count
+    if section is not None:
+        stats = section  # The log ended inside a statistics section.
+    if stats is None:
+        raise ValueError('No statistics section found in the Yosys log.')
+    # Trim the blank lines surrounding the statistics.
+    while stats['lines'] and not stats['lines'][0].strip():
+        stats['lines'].pop(0)
+    while stats['lines'] and not stats['lines'][-1].strip():
+        stats['lines'].pop()
+    return YosysStats(**stats)
+
+def run_yosys(verilog_file, script='synth_ice40'):
+    '''Run Yosys on a Verilog file and return its log output one line at a time as it's generated.'''
+    with subprocess.Popen(['yosys', '-p', script, verilog_file],
+                          stdout=subprocess.PIPE, universal_newlines=True) as yosys:
+        for line in yosys.stdout:
+            yield line
+    if yosys.returncode:
+        raise subprocess.CalledProcessError(yosys.returncode, yosys.args)
+
 def print_stats(yosys_log):
-    stat_start_line = yosys_log.grep(r'^2\.27\. ')
-    stat_end_line = yosys_log.grep(r'^2\.28\. ')
-    start_index = yosys_log.index(stat_start_line[0])
-    end_index = yosys_log.index(stat_end_line[0])
-    print('\n'.join(yosys_log[start_index+2:end_index-1]))
+    '''Print just the FPGA resource usage stats from the Yosys log output.'''
+    print('\n'.join(parse_stats(yosys_log).lines))
 
 
 from pygmyhdl import *
@@ -95,22 +159,58 @@ toVerilog(ram, clk_i=Wire(), en_i=Wire(), wr_i=Wire(), addr_i=Bus(8), data_i=Bus
 
 
 
-log = !yosys -p "synth_ice40" ram.v
-print_stats(log)                     # Just print the FPGA resource usage stats from the log output.
+print_stats(run_yosys('ram.v'))  # Just print the FPGA resource usage stats from the log output.
 
 
-def ram(clk_i,wr_i, addr_i, data_i, data_o):
+def read_mem_file(file_name, depth, width):
+    '''
+    Read the initial contents of a RAM from a $readmemh-style file and return a list with a value
+    for each of the depth locations. Words are in hex and separated by whitespace, @<hex address>
+    jumps to a new location, // starts a comment, and any locations not in the file are set to 0.
+    '''
+    values = [0] * depth
+    addr = 0
+    with open(file_name) as mem_file:
+        for line in mem_file:
+            for word in line.split('//')[0].split():
+                if word.startswith('@'):
+                    addr = int(word[1:], 16)
+                    continue
+                if addr >= depth:
+                    raise ValueError('{}: address {} is past the end of a {}-word RAM.'.format(file_name, addr, depth))
+                value = int(word.replace('_', ''), 16)
+                if value >= 2**width:
+                    raise ValueError('{}: value {} does not fit in a {}-bit word.'.format(file_name, word, width))
+                values[addr] = value
+                addr += 1
+    return values
+
+def write_mem_file(file_name, mem):
+    '''Write the current contents of a RAM's list of words to a $readmemh-style file, one hex word per line.'''
+    digits = (len(mem[0]) + 3) // 4
+    with open(file_name, 'w') as mem_file:
+        for word in mem:
+            mem_file.write('{:0{}x}\n'.format(int(word.val), digits))
+
+def ram(clk_i,wr_i, addr_i, data_i, data_o, init_file=None, mem_o=None):
     '''
     Inputs:
       clk_i:  Data is read/written on the rising edge of this clock input.
       wr_i:   When high, data is written to the RAM; when low, data is read from the RAM.
       addr_i: Address bus for selecting which RAM location is being read/written.
       data_i: Data bus for writing data into the RAM.
+      init_file: Optional $readmemh-style file with the initial RAM contents.
+                 (Set toVerilog.initial_values = True to put them in the Verilog, too.)
     Outputs:
       data_o: Data bus for reading data from the RAM.
+      mem_o:  Optional list that gets the RAM's words so a test bench can dump them with write_mem_file().
     '''
     
-    mem = [Bus(len(data_i)) for _ in range(2**len(addr_i))]
+    depth = 2**len(addr_i)
+    init_vals = read_mem_file(init_file, depth, len(data_i)) if init_file else [0] * depth
+    mem = [Bus(len(data_i), init_val=v) for v in init_vals]
+    if mem_o is not None:
+        mem_o.extend(mem)
     
     @seq_logic(clk_i.posedge)
     def logic():
@@ -121,8 +221,7 @@ def ram(clk_i,wr_i, addr_i, data_i, data_o):
                 
 toVerilog(ram, clk_i=Wire(), wr_i=Wire(), addr_i=Bus(8), data_i=Bus(8), data_o=Bus(8))
 
-log = !yosys -p "synth_ice40" ram.v
-print_stats(log)
+print_stats(run_yosys('ram.v'))
 
 
 
@@ -147,12 +246,11 @@ def simpler_ram(clk_i,wr_i, addr_i, data_i, data_o):
                 
 toVerilog(simpler_ram, clk_i=Wire(), wr_i=Wire(), addr_i=Bus(8), data_i=Bus(8), data_o=Bus(8))
 
-log = !yosys -p "synth_ice40" simpler_ram.v
-print_stats(log)
+print_stats(run_yosys('simpler_ram.v'))
 
 
 
-def dualport_ram(clk_i, wr_i, wr_addr_i, rd_addr_i, data_i, data_o):
+def dualport_ram(clk_i, wr_i, wr_addr_i, rd_addr_i, data_i, data_o, init_file=None, mem_o=None):
     '''
     Inputs:
       clk_i:     Data is read/written on the rising edge of this clock input.
@@ -160,11 +258,17 @@ def dualport_ram(clk_i, wr_i, wr_addr_i, rd_addr_i, data_i, data_o):
       wr_addr_i: Address bus for selecting which RAM location is being written.
       rd_addr_i: Address bus for selecting which RAM location is being read.
       data_i:    Data bus for writing data into the RAM.
+      init_file: Optional $readmemh-style file with the initial RAM contents.
     Outputs:
       data_o:    Data bus for reading data from the RAM.
+      mem_o:     Optional list that gets the RAM's words so a test bench can dump them with write_mem_file().
     '''
     
-    mem = [Bus(len(data_i)) for _ in range(2**len(wr_addr_i))]
+    depth = 2**len(wr_addr_i)
+    init_vals = read_mem_file(init_file, depth, len(data_i)) if init_file else [0] * depth
+    mem = [Bus(len(data_i), init_val=v) for v in init_vals]
+    if mem_o is not None:
+        mem_o.extend(mem)
     
     @seq_logic(clk_i.posedge)
     def logic():
@@ -212,19 +316,101 @@ simulate(ram_test_bench())
 show_text_table('clk wr wr_addr data_i rd_addr data_o')
 
 
-toVerilog(ram, clk_i=Wire(), wr_i=Wire(), addr_i=Bus(9), data_i=Bus(10), data_o=Bus(10))
-log = !yosys -p "synth_ice40" ram.v
-print_stats(log)
-
-
-toVerilog(ram, clk_i=Wire(), wr_i=Wire(), addr_i=Bus(7), data_i=Bus(24), data_o=Bus(24))
-log = !yosys -p "synth_ice40" ram.v
-print_stats(log)
-
-
-toVerilog(ram, clk_i=Wire(), wr_i=Wire(), addr_i=Bus(9), data_i=Bus(24), data_o=Bus(24))
-log = !yosys -p "synth_ice40" ram.v
-print_stats(log)
+# Instead of writing the RAM from the test bench, load it from a file before the simulation starts.
+# Then dump the RAM contents to another file once the simulation is done.
+with tempfile.TemporaryDirectory() as tmp_dir:
+    init_file = os.path.join(tmp_dir, 'ram_init.hex')
+    dump_file = os.path.join(tmp_dir, 'ram_dump.hex')
+    with open(init_file, 'w') as hex_file:
+        hex_file.write(' '.join('{:02x}'.format(3 * i + 1) for i in range(10)))
+
+    initialize()
+    clk = Wire(name='clk')
+    wr = Wire(name='wr')
+    wr_addr = Bus(8, name='wr_addr')
+    rd_addr = Bus(8, name='rd_addr')
+    data_i = Bus(8, name='data_i')
+    data_o = Bus(8, name='data_o')
+    mem = []  # This will get the RAM words so they can be dumped later.
+    dualport_ram(clk_i=clk, wr_i=wr, wr_addr_i=wr_addr, rd_addr_i=rd_addr, data_i=data_i, data_o=data_o,
+                 init_file=init_file, mem_o=mem)
+
+    def ram_read_bench():
+        for i in range(10):
+            rd_addr.next = i            # Read back the 10 locations loaded from the file...
+            wr_addr.next = i + 10       # ...while writing double their values into the next 10 locations.
+            data_i.next = 2 * (3 * i + 1)
+            wr.next = 1
+            clk.next = 0
+            yield delay(1)
+            clk.next = 1
+            yield delay(1)
+
+    simulate(ram_read_bench())
+    show_text_table('clk rd_addr data_o wr_addr data_i')
+
+    write_mem_file(dump_file, mem)
+    with open(dump_file) as hex_file:
+        print(' '.join(hex_file.read().split()[:20]))  # The loaded values followed by the written ones.
+
+
+def convert_to(settings, chunk, *args, **kwargs):
+    '''
+    Convert a chunk to Verilog with some toVerilog settings (name, directory, no_testbench, ...)
+    changed for just this conversion. The old settings are put back even if the conversion fails.
+    '''
+    old_settings = {setting: getattr(toVerilog, setting) for setting in settings}
+    try:
+        for setting, value in settings.items():
+            setattr(toVerilog, setting, value)
+        return toVerilog(chunk, *args, **kwargs)
+    finally:
+        for setting, value in old_settings.items():
+            setattr(toVerilog, setting, value)
+
+def sweep(chunk, make_args, **grid):
+    '''
+    Convert a chunk to Verilog for every combination of the parameter values in the grid,
+    synthesize all of them in parallel, and return the FPGA resource usage of each one.
+    Inputs:
+        chunk:     The function that creates the logic.
+        make_args: Function that takes the parameters of one grid point as keyword arguments
+                   and returns the keyword arguments for converting the chunk to Verilog.
+        grid:      Each keyword is a parameter name and its value is the list of values to try.
+    Outputs:
+        A list with a dictionary for each grid point holding its parameter values, the Verilog
+        conversion time in seconds, and the LUT, DFF, RAM block and carry counts.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        # Convert each grid point into its own Verilog file in a scratch directory. MyHDL
+        # conversion uses global state, so this has to be done one point at a time.
+        for values in itertools.product(*grid.values()):
+            point = dict(zip(grid.keys(), values))
+            name = '_'.join([chunk.__name__] + ['{}{}'.format(k, v) for k, v in point.items()])
+            start_time = time.perf_counter()
+            convert_to(dict(name=name, directory=tmp_dir, no_testbench=True), chunk, **make_args(**point))
+            convert_time = time.perf_counter() - start_time
+            results.append(dict(point, convert_time=convert_time, verilog_file=os.path.join(tmp_dir, name + '.v')))
+
+        # Each Yosys run is a separate process, so all the grid points can be synthesized at the same time.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            all_stats = pool.map(lambda result: parse_stats(run_yosys(result.pop('verilog_file'))), results)
+            for result, stats in zip(results, all_stats):
+                result.update(luts=stats.luts, dffs=stats.dffs, rams=stats.rams, carries=stats.carries)
+    return results
+
+# Try RAMs with 7- and 9-bit addresses and 10- and 24-bit data words to see how the block RAM usage scales.
+ram_results = sweep(ram,
+                    lambda addr_width, data_width: dict(clk_i=Wire(), wr_i=Wire(), addr_i=Bus(addr_width),
+                                                        data_i=Bus(data_width), data_o=Bus(data_width)),
+                    addr_width=[7, 9], data_width=[10, 24])
+
+# Print a table of the results with the cheapest RAMs first.
+print('addr_width data_width  RAMs  LUTs  DFFs  convert time')
+for r in sorted(ram_results, key=lambda r: (r['rams'], r['luts'], r['dffs'])):
+    print('{addr_width:10} {data_width:10} {rams:5} {luts:5} {dffs:5} {convert_time:11.3f}s'.format(**r))
 
 
 def gen_reset(clk_i, reset_o):
@@ -264,7 +450,9 @@ def sample_en(clk_i, do_sample_o, frq_in=12e6, frq_sample=100):
     # on the master clock frequency and the desired sampling frequency.
     from math import ceil, log2
     rollover = int(ceil(frq_in / frq_sample)) - 1
-    cntr = Bus(int(ceil(log2(frq_in/frq_sample))))
+    # Keep at least one counter bit in case frq_sample is as high as frq_in, where the pulse
+    # comes out every clock cycle.
+    cntr = Bus(max(1, int(ceil(log2(frq_in/frq_sample)))))
     
     # Sequential logic for generating the sampling pulse.
     @seq_logic(clk_i.posedge)
@@ -276,13 +464,18 @@ def sample_en(clk_i, do_sample_o, frq_in=12e6, frq_sample=100):
             cntr.next = 0 
 
 
-def record_play(clk_i, button_a, button_b, leds_o):
+def record_play(clk_i, button_a, button_b, leds_o, frq_in=12e6, frq_sample=100, init_file=None, init_end_addr=0):
     '''
     Sample value on button B input, store in RAM, and playback by turning LEDs on/off.
     Inputs:
-        clk_i:    Clock input.
-        button_a: Button A input. High when pressed. Controls record/play operation.
-        button_b: Button B input. High when pressed. Used to input samples for controlling LEDs.
+        clk_i:      Clock input.
+        button_a:   Button A input. High when pressed. Controls record/play operation.
+        button_b:   Button B input. High when pressed. Used to input samples for controlling LEDs.
+        frq_in:     Frequency of the input clock (defaults to 12 MHz).
+        frq_sample: Frequency for sampling button B (defaults to 100 Hz).
+        init_file:  Optional $readmemh-style file of samples to preload into the RAM.
+                    Pressing button B in the INIT state plays them back without recording first.
+        init_end_addr: Address of the last preloaded sample.
     Outputs:
         leds_o:   LED outputs.
     '''
@@ -293,15 +486,15 @@ def record_play(clk_i, button_a, button_b, leds_o):
     
     # Instantiate the sampling pulse generator.
     do_sample = Wire()
-    sample_en(clk_i, do_sample)
+    sample_en(clk_i, do_sample, frq_in, frq_sample)
     
     # Instantiate a RAM for holding the samples.
     wr = Wire()
     addr = Bus(11)
-    end_addr = Bus(len(addr)) # Holds the last address of the recorded samples.
+    end_addr = Bus(len(addr), init_val=init_end_addr) # Holds the last address of the recorded samples.
     data_i = Bus(1)
     data_o = Bus(1)
-    ram(clk_i, wr, addr, data_i, data_o)
+    ram(clk_i, wr, addr, data_i, data_o, init_file)
     
     # States of the record/playback controller.
     state = Bus(3)         # Holds the current state of the controller.
@@ -311,6 +504,9 @@ def record_play(clk_i, button_a, button_b, leds_o):
     WAITING_TO_PLAY = 3    # Getting ready to play back samples.
     PLAYING = 4            # Actually playing back samples.
 
+    # Button B only starts playback from the INIT state if there are preloaded samples to play.
+    PRELOADED_PLAY = WAITING_TO_PLAY if init_file else INIT
+
     # Sequential logic for the record/playback controller.
     @seq_logic(clk_i.posedge)
     def fsm():
@@ -327,6 +523,9 @@ def record_play(clk_i, button_a, button_b, leds_o):
                 if button_a == 1:
                     # Get ready to start recording when button A is pressed.
                     state.next = WAITING_TO_RECORD  # Go to record setup state.
+                elif button_b == 1:
+                    # Get ready to play back the preloaded samples when button B is pressed.
+                    state.next = PRELOADED_PLAY
                     
             elif state == WAITING_TO_RECORD:  # Setup for recording.
                 leds_o.next = 0b11010  # Light LEDs to indicate this state.
@@ -367,6 +566,65 @@ def record_play(clk_i, button_a, button_b, leds_o):
 
 
 
+initialize()
+
+# At 12 MHz and 100 Hz, record_play takes 120,000 clocks for each sample. For the simulation,
+# say the clock is 4 Hz and sample at 1 Hz, so there's a sample every four clocks.
+clk = Wire(name='clk')
+button_a = Wire(name='button_a')
+button_b = Wire(name='button_b')
+leds = Bus(5, name='leds')
+record_play(clk, button_a, button_b, leds, frq_in=4, frq_sample=1)
+
+def hold(num_samples):
+    # Pulse the clock long enough for the given number of sampling pulses.
+    for _ in range(4 * num_samples):
+        clk.next = 0
+        yield delay(1)
+        clk.next = 1
+        yield delay(1)
+
+def record_play_tb():
+    yield from hold(2)                   # Let the reset finish.
+    button_a.next = 1                    # Press button A to get ready to record...
+    yield from hold(2)
+    button_a.next = 0                    # ...and release it to start recording.
+    for b in [1, 1, 0, 1, 0, 0]:         # Record a pattern on button B.
+        button_b.next = b
+        yield from hold(1)
+    button_a.next = 1                    # Press button A to get ready to play back...
+    yield from hold(2)
+    button_a.next = 0                    # ...and release it to start playing.
+    yield from hold(14)                  # Watch the recorded pattern repeat on the LEDs.
+
+simulate(record_play_tb())
+show_waveforms('clk button_a button_b leds', tick=True, width=2000)
+
+
+# Preload the RAM with a pattern of samples and play it back without recording anything.
+with tempfile.TemporaryDirectory() as tmp_dir:
+    init_file = os.path.join(tmp_dir, 'samples.hex')
+    with open(init_file, 'w') as hex_file:
+        hex_file.write('1 0 1 1 0 0')
+
+    initialize()
+    clk = Wire(name='clk')
+    button_a = Wire(name='button_a')
+    button_b = Wire(name='button_b')
+    leds = Bus(5, name='leds')
+    record_play(clk, button_a, button_b, leds, frq_in=4, frq_sample=1, init_file=init_file, init_end_addr=5)
+
+def preloaded_play_tb():
+    yield from hold(2)                   # Let the reset finish.
+    button_b.next = 1                    # Press button B to play the preloaded samples...
+    yield from hold(1)
+    button_b.next = 0
+    yield from hold(14)                  # ...and watch the pattern repeat on the LEDs.
+
+simulate(preloaded_play_tb())
+show_waveforms('clk button_b leds', tick=True, width=2000)
+
+
 toVerilog(record_play, clk_i=Wire(), button_a=Wire(), button_b=Wire(), leds_o=Bus(5))
 
 with open('record_play.pcf', 'w') as pcf:
@@ -1,3 +1,70 @@
+# Functions I'll use later to get the FPGA resource usage from Yosys log output.
+# (These are the same ones used in the RAM tutorial.)
+import os
+import re
+import subprocess
+import tempfile
+from collections import namedtuple
+
+# FPGA resources used by a design, plus the lines of the Yosys statistics section they came from.
+YosysStats = namedtuple('YosysStats', 'luts dffs rams carries cells lines')
+
+def parse_stats(log_lines):
+    '''
+    Scan the Yosys log output one line at a time and return the resource usage found in
+    the last "Printing statistics" section. The log can be any iterable of lines (the output
+    of a ! shell command, an open log file, or the pipe from run_yosys()) so only the
+    statistics section is ever kept in memory, no matter how big the log is.
+    '''
+    stats, section = None, None
+    for line in log_lines:
+        line = line.rstrip('\n')
+        if re.match(r'^\d+(\.\d+)*\. ', line):
+            # A numbered heading starts a new Yosys pass. Finish up any statistics that
+            # were being collected and start collecting if this is a statistics pass.
+            if section is not None:
+                stats = section
+            section = dict(luts=0, dffs=0, rams=0, carries=0, cells=0, lines=[]) if 'Printing statistics' in line else None
+            continue
+        if section is None:
+            continue
+        section['lines'].append(line)
+        cells = re.match(r'^\s+Number of cells:\s+(\d+)', line)
+        if cells:
+            section['cells'] = int(cells.group(1))
+            continue
+        cell = re.match(r'^\s+(SB_\w+)\s+(\d+)\s*$', line)
+        if cell:
+            cell_type, count = cell.group(1), int(cell.group(2))
+            if cell_type.startswith('SB_LUT'):
+                section['luts'] += count
+            elif cell_type.startswith('SB_DFF'):
+                section['dffs'] += count
+            elif cell_type.startswith('SB_RAM'):
+                section['rams'] += count
+            elif cell_type.startswith('SB_CARRY'):
+                section['carries'] += count
+    if section is not None:
+        stats = section  # The log ended inside a statistics section.
+    if stats is None:
+        raise ValueError('No statistics section found in the Yosys log.')
+    # Trim the blank lines surrounding the statistics.
+    while stats['lines'] and not stats['lines'][0].strip():
+        stats['lines'].pop(0)
+    while stats['lines'] and not stats['lines'][-1].strip():
+        stats['lines'].pop()
+    return YosysStats(**stats)
+
+def run_yosys(verilog_file, script='synth_ice40'):
+    '''Run Yosys on a Verilog file and return its log output one line at a time as it's generated.'''
+    with subprocess.Popen(['yosys', '-p', script, verilog_file],
+                          stdout=subprocess.PIPE, universal_newlines=True) as yosys:
+        for line in yosys.stdout:
+            yield line
+    if yosys.returncode:
+        raise subprocess.CalledProcessError(yosys.returncode, yosys.args)
+
+
 from pygmyhdl import *
 
 def counter(clk_i, cnt_o):
@@ -108,7 +175,7 @@ def debouncer(clk_i, button_i, button_o, debounce_time):
 
     # These are the state variables of the FSM.
     from math import ceil, log2
-    debounce_cnt = Bus(int(ceil(log2(debounce_time+1))), name='dbcnt')  # Counter big enough to store debounce time.
+    debounce_cnt = Bus(max(1, int(ceil(log2(debounce_time+1)))), name='dbcnt')  # Counter big enough to store debounce time.
     prev_button = Wire(name='prev_button')  # Stores the button value from the previous clock cycle.
     
     @seq_logic(clk_i.posedge)
@@ -390,17 +457,19 @@ set_io inputs_i[1] 114
 !iceprog classic_fsm.bin
 
 
-def classic_fsm(clk_i, inputs_i, outputs_o):
+def classic_fsm(clk_i, inputs_i, outputs_o, debounce_time=120000, encoding='binary'):
 
-    fsm_state = State('A', 'B', 'C', 'D', name='state')
+    # The encoding sets how the states are stored: 'binary' uses the fewest flip-flops, while
+    # 'one_hot' and 'one_cold' use a flip-flop for each state but can need less logic to decode it.
+    fsm_state = State('A', 'B', 'C', 'D', name='state', encoding=encoding)
     reset_cnt = Bus(2)
     
     prev_inputs = Bus(len(inputs_i), name='prev_inputs')
     input_chgs = Bus(len(inputs_i), name='input_chgs')
 
     # Take the inputs and run them through the debounce circuits.
+    # The default debounce time is 10 ms with the 12 MHz clock.
     dbnc_inputs = Bus(len(inputs_i))  # These are the inputs after debouncing.
-    debounce_time = 120000
     debouncer(clk_i, inputs_i.o[0], dbnc_inputs.i[0], debounce_time)
     debouncer(clk_i, inputs_i.o[1], dbnc_inputs.i[1], debounce_time)
 
@@ -453,7 +522,59 @@ def classic_fsm(clk_i, inputs_i, outputs_o):
             outputs_o.next = 0b1111
 
 
-toVerilog(classic_fsm, clk_i=Wire(), inputs_i=Bus(2), outputs_o=Bus(4))
+initialize()
+
+# Simulate the debounced FSM with a debounce time of only three clock cycles instead of 120,000.
+inputs = Bus(2, name='inputs')
+outputs = Bus(4, name='outputs')
+clk = Wire(name='clk')
+classic_fsm(clk, inputs, outputs, debounce_time=3)
+
+def fsm_tb():
+    nop = 0b00
+    fwd = 0b01
+    bck = 0b10
+
+    # Hold each input combination for longer than the debounce time so it gets through the debouncers.
+    ins = [nop, fwd, nop, fwd, nop, fwd, nop, bck, nop, bck, nop, bck, nop]
+    for inputs.next in ins:
+        for _ in range(6):
+            clk.next = 0
+            yield delay(1)
+            clk.next = 1
+            yield delay(1)
+
+simulate(fsm_tb())
+show_waveforms('clk inputs prev_inputs input_chgs state outputs', tick=True, width=2000)
+
+
+def convert_to(settings, chunk, *args, **kwargs):
+    '''
+    Convert a chunk to Verilog with some toVerilog settings (name, directory, no_testbench, ...)
+    changed for just this conversion. The old settings are put back even if the conversion fails.
+    '''
+    old_settings = {setting: getattr(toVerilog, setting) for setting in settings}
+    try:
+        for setting, value in settings.items():
+            setattr(toVerilog, setting, value)
+        return toVerilog(chunk, *args, **kwargs)
+    finally:
+        for setting, value in old_settings.items():
+            setattr(toVerilog, setting, value)
+
+# Synthesize the FSM with each state encoding and use the one that needs the fewest LUTs.
+# The trial Verilog files go into a scratch directory so they don't clutter up this one.
+fsm_luts = {}
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for encoding in ('binary', 'one_hot', 'one_cold'):
+        name = 'classic_fsm_' + encoding
+        convert_to(dict(name=name, directory=tmp_dir, no_testbench=True),
+                   classic_fsm, clk_i=Wire(), inputs_i=Bus(2), outputs_o=Bus(4), encoding=encoding)
+        fsm_luts[encoding] = parse_stats(run_yosys(os.path.join(tmp_dir, name + '.v'))).luts
+best_encoding = min(fsm_luts, key=fsm_luts.get)
+print(fsm_luts, '=> using', best_encoding)
+
+toVerilog(classic_fsm, clk_i=Wire(), inputs_i=Bus(2), outputs_o=Bus(4), encoding=best_encoding)
 
 with open('classic_fsm.pcf', 'w') as pcf:
     pcf.write(